@@ -154,14 +154,14 @@ class MacFactory(GUIFactory):
 #=================
 #=================
 
-class Singleton:
-    _instance = None
+import os
+import threading
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.value = "Initial Value"
-        return cls._instance
+from sdp import SingletonMeta
+
+class Singleton(metaclass=SingletonMeta):
+    def __init__(self):
+        self.value = "Initial Value"
 
     def get_value(self):
         return self.value
@@ -221,7 +221,9 @@ class Director:
 #=================
 #=================
 
-import copy
+from sdp import CloneEngine
+
+_clone_engine = CloneEngine()
 
 class Shape(ABC):
     @abstractmethod
@@ -237,7 +239,7 @@ class Circle(Shape):
         self.radius = radius
 
     def clone(self):
-        return copy.deepcopy(self)
+        return _clone_engine.copy(self)
 
     def draw(self):
         return f"Drawing Circle with radius {self.radius}"
@@ -248,7 +250,7 @@ class Rectangle(Shape):
         self.height = height
 
     def clone(self):
-        return copy.deepcopy(self)
+        return _clone_engine.copy(self)
 
     def draw(self):
         return f"Drawing Rectangle with width {self.width} and height {self.height}"
@@ -264,6 +266,10 @@ class ShapeRegistry:
         shape = self._shapes.get(name)
         return shape.clone() if shape else None
 
+    def clone_many(self, name, n):
+        shape = self._shapes.get(name)
+        return [shape.clone() for _ in range(n)] if shape else [None] * n
+
 #=================
 #=================
 # Adapter Design Pattern
@@ -345,11 +351,34 @@ class Remote:
 #=================
 #=================
 
+from sdp import ENTER, Rope, walk, aggregate_postorder
+
 class Component(ABC):
+    _parents = ()
+
     @abstractmethod
     def operation(self):
         pass
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value
+        self.changed()
+
+    def changed(self):
+        if getattr(self, "_cache", None) is not None:
+            self._cache = None
+        stack = list(self._parents)
+        while stack:
+            node = stack.pop()
+            if node._cache is not None:
+                node._cache = None
+                stack.extend(node._parents)
+
 class Leaf(Component):
     def __init__(self, name):
         self.name = name
@@ -358,16 +387,74 @@ class Leaf(Component):
         return f"Leaf {self.name}"
 
 class Composite(Component):
+    # As in sdp: subtrees longer than cache_limit characters are built as
+    # Ropes and left uncached, so deep trees stay linear in memory.
+    cache_hits = 0
+    cache_misses = 0
+    cache_limit = 1 << 12
+
     def __init__(self, name):
+        self._cache = None
         self.name = name
         self.children = []
 
     def add(self, component):
         self.children.append(component)
+        if "_parents" not in component.__dict__:
+            component._parents = []
+        component._parents.append(self)
+        self._cache = None
+        self.changed()
+
+    @staticmethod
+    def _is_dirty(node):
+        return isinstance(node, Composite) and node._cache is None
 
     def operation(self):
-        results = [child.operation() for child in self.children]
-        return f"Composite {self.name} contains: " + ", ".join(results)
+        if self._cache is not None:
+            Composite.cache_hits += 1
+            return self._cache
+
+        def combine(node, results):
+            if not Composite._is_dirty(node):
+                return node.operation()
+            Composite.cache_misses += 1
+            parts = [f"Composite {node.name} contains: "]
+            for i, result in enumerate(results):
+                if i:
+                    parts.append(", ")
+                parts.append(result)
+            text = Rope(parts)
+            if len(text) > Composite.cache_limit:
+                return text
+            node._cache = str(text)
+            return node._cache
+        return str(aggregate_postorder(self, combine, Composite._is_dirty))
+
+    def iter_operation(self):
+        if self._cache is not None:
+            Composite.cache_hits += 1
+            yield self._cache
+            return
+        first = []
+        for event, node in walk(self, Composite._is_dirty):
+            dirty = Composite._is_dirty(node)
+            if event is ENTER:
+                if first:
+                    if not first[-1]:
+                        yield ", "
+                    first[-1] = False
+                if dirty:
+                    first.append(True)
+                    yield f"Composite {node.name} contains: "
+            elif dirty:
+                first.pop()
+            else:
+                yield node.operation()
+
+    @classmethod
+    def reset_cache_stats(cls):
+        Composite.cache_hits = Composite.cache_misses = 0
 
 #=================
 #=================
@@ -385,26 +472,62 @@ class BasicNotifier(Notifier):
         return f"Sending message: {message}"
 
 class NotifierDecorator(Notifier):
+    channel = None
+
     def __init__(self, wrappee: Notifier):
         self.wrappee = wrappee
 
     def send(self, message):
-        return self.wrappee.send(message)
+        base = self.wrappee.send(message)
+        if self.channel is None:
+            return base
+        return f"{base}\nSending {self.channel}: {message}"
 
 class SMSDecorator(NotifierDecorator):
-    def send(self, message):
-        base = super().send(message)
-        return f"{base}\nSending SMS: {message}"
+    channel = "SMS"
 
 class EmailDecorator(NotifierDecorator):
-    def send(self, message):
-        base = super().send(message)
-        return f"{base}\nSending Email: {message}"
+    channel = "Email"
 
 class SlackDecorator(NotifierDecorator):
-    def send(self, message):
-        base = super().send(message)
-        return f"{base}\nSending Slack message: {message}"
+    channel = "Slack message"
+
+def compile_notifier(notifier):
+    # Flatten a decorator stack into one callable. Each layer's text is
+    # pre-joined into a list of fragments with the message as separator,
+    # so a send costs a single str.join however many layers there are.
+    # A layer that overrides send() is opaque and is called as is.
+    suffixes = []
+    while isinstance(notifier, NotifierDecorator) and type(notifier).send is NotifierDecorator.send:
+        if notifier.channel is not None:
+            suffixes.append(f"\nSending {notifier.channel}: ")
+        notifier = notifier.wrappee
+    suffixes.reverse()
+    if type(notifier) is BasicNotifier:
+        parts = ["Sending message: "] + suffixes + [""]
+        return lambda message: format(message).join(parts)
+    inner = notifier.send
+    if not suffixes:
+        return inner
+    parts = suffixes + [""]
+    return lambda message: inner(message) + format(message).join(parts)
+
+def benchmark_notifiers(layers=(1, 10, 100), calls=100_000):
+    import timeit
+
+    channels = [SMSDecorator, EmailDecorator, SlackDecorator]
+    results = {}
+    for depth in layers:
+        notifier = BasicNotifier()
+        for i in range(depth):
+            notifier = channels[i % len(channels)](notifier)
+        fused = compile_notifier(notifier)
+        assert fused("hi") == notifier.send("hi")
+        results[depth] = (timeit.timeit(lambda: notifier.send("hi"), number=calls),
+                          timeit.timeit(lambda: fused("hi"), number=calls))
+        print(f"{depth:>4} layers: layered {results[depth][0]:.3f}s, "
+              f"compiled {results[depth][1]:.3f}s for {calls} calls")
+    return results
 
 #=================
 #=================
@@ -460,15 +583,41 @@ class TreeType:
     def draw(self, x, y):
         return f"Drawing {self.name} tree at ({x}, {y}) with color {self.color}"
 
+from sdp import InterningStore
+
 class TreeFactory:
-    _tree_types = {}
+    _tree_types = InterningStore()
+
+    @classmethod
+    def configure(cls, weak=False, max_size=None, stripes=16):
+        cls._tree_types = InterningStore(weak, max_size, stripes)
 
     @classmethod
     def get_tree_type(cls, name, color, texture):
         key = (name, color, texture)
-        if key not in cls._tree_types:
-            cls._tree_types[key] = TreeType(name, color, texture)
-        return cls._tree_types[key]
+        return cls._tree_types.get_or_create(key, lambda: TreeType(name, color, texture))
+
+    # Dense integer ids for array-backed scenes. An id pins its TreeType,
+    # so ids stay valid even when the interning store is weak or bounded.
+    _type_table = []
+    _type_ids = {}
+    _type_lock = threading.Lock()
+
+    @classmethod
+    def type_id(cls, name, color, texture):
+        key = (name, color, texture)
+        type_id = cls._type_ids.get(key)
+        if type_id is None:
+            with cls._type_lock:
+                type_id = cls._type_ids.get(key)
+                if type_id is None:
+                    cls._type_table.append(cls.get_tree_type(name, color, texture))
+                    type_id = cls._type_ids[key] = len(cls._type_table) - 1
+        return type_id
+
+    @classmethod
+    def type_by_id(cls, type_id):
+        return cls._type_table[type_id]
 
 class Tree:
     def __init__(self, x, y, tree_type):
@@ -479,16 +628,375 @@ class Tree:
     def draw(self):
         return self.tree_type.draw(self.x, self.y)
 
+import heapq
+import math
+
+class GridIndex:
+    # Uniform grid of square cells mapping (cx, cy) -> list of item ids.
+    # Queries only visit the cells they overlap, so their cost follows the
+    # size of the result rather than the number of indexed points.
+    def __init__(self, cell_size=64.0):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._points = []
+        self._bounds = None
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, x, y):
+        item = len(self._points)
+        self._points.append((x, y))
+        cx, cy = self._cell(x, y)
+        self._cells.setdefault((cx, cy), []).append(item)
+        if self._bounds is None:
+            self._bounds = [cx, cy, cx, cy]
+        else:
+            b = self._bounds
+            b[0], b[1], b[2], b[3] = min(b[0], cx), min(b[1], cy), max(b[2], cx), max(b[3], cy)
+        return item
+
+    def query_rect(self, x0, y0, x1, y1):
+        # Clamp to the occupied bounds so a huge viewport does not walk
+        # empty cells; if it still covers more cells than are occupied,
+        # scan the occupied cells instead.
+        if self._bounds is None:
+            return []
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        cx0, cy0 = self._cell(x0, y0)
+        cx1, cy1 = self._cell(x1, y1)
+        cx0, cy0, cx1, cy1 = max(cx0, min_cx), max(cy0, min_cy), min(cx1, max_cx), min(cy1, max_cy)
+        if cx0 > cx1 or cy0 > cy1:
+            return []
+        cells, points, found = self._cells, self._points, []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            overlapping = (items for (cx, cy), items in cells.items()
+                           if cx0 <= cx <= cx1 and cy0 <= cy <= cy1)
+        else:
+            overlapping = (cells.get((cx, cy), ()) for cx in range(cx0, cx1 + 1)
+                           for cy in range(cy0, cy1 + 1))
+        for items in overlapping:
+            for item in items:
+                x, y = points[item]
+                if x0 <= x <= x1 and y0 <= y <= y1:
+                    found.append(item)
+        return found
+
+    def query_radius(self, x, y, radius):
+        r2 = radius * radius
+        points = self._points
+        return [item for item in self.query_rect(x - radius, y - radius, x + radius, y + radius)
+                if (points[item][0] - x) ** 2 + (points[item][1] - y) ** 2 <= r2]
+
+    def nearest(self, x, y, k=1):
+        # Search square rings of cells outward, starting at the first ring
+        # that reaches the occupied bounds. Anything beyond ring r is at
+        # least r * cell_size away, so once k candidates are that close the
+        # answer is final. A ring with more cells than are occupied is not
+        # walked: the remaining occupied cells are scanned instead.
+        if k <= 0 or self._bounds is None:
+            return []
+        cx, cy = self._cell(x, y)
+        min_cx, min_cy, max_cx, max_cy = self._bounds
+        first_ring = max(min_cx - cx, cx - max_cx, min_cy - cy, cy - max_cy, 0)
+        max_ring = max(abs(cx - min_cx), abs(cx - max_cx), abs(cy - min_cy), abs(cy - max_cy))
+        cells, points, best = self._cells, self._points, []
+
+        def add(items):
+            for item in items:
+                px, py = points[item]
+                best.append(((px - x) ** 2 + (py - y) ** 2, item))
+
+        for ring in range(first_ring, max_ring + 1):
+            if 8 * ring > len(cells):
+                for (gx, gy), items in cells.items():
+                    if max(abs(gx - cx), abs(gy - cy)) >= ring:
+                        add(items)
+                break
+            for gx in range(max(cx - ring, min_cx), min(cx + ring, max_cx) + 1):
+                if abs(gx - cx) == ring:
+                    column = range(max(cy - ring, min_cy), min(cy + ring, max_cy) + 1)
+                else:
+                    column = [gy for gy in {cy - ring, cy + ring} if min_cy <= gy <= max_cy]
+                for gy in column:
+                    add(cells.get((gx, gy), ()))
+            if len(best) >= k:
+                best = heapq.nsmallest(k, best)
+                if best[-1][0] <= (ring * self.cell_size) ** 2:
+                    break
+        return [item for _, item in heapq.nsmallest(k, best)]
+
 class Forest:
-    def __init__(self):
+    def __init__(self, cell_size=64.0):
         self.trees = []
+        self.index = GridIndex(cell_size)
 
     def plant_tree(self, x, y, name, color, texture):
         type_ = TreeFactory.get_tree_type(name, color, texture)
         self.trees.append(Tree(x, y, type_))
+        self.index.insert(x, y)
+
+    def query_rect(self, x0, y0, x1, y1):
+        return [self.trees[i] for i in sorted(self.index.query_rect(x0, y0, x1, y1))]
+
+    def query_radius(self, x, y, radius):
+        return [self.trees[i] for i in sorted(self.index.query_radius(x, y, radius))]
+
+    def nearest(self, x, y, k=1):
+        return [self.trees[i] for i in self.index.nearest(x, y, k)]
+
+    def draw(self, viewport=None):
+        # viewport is (x0, y0, x1, y1); trees keep their planting order.
+        trees = self.trees if viewport is None else self.query_rect(*viewport)
+        return [tree.draw() for tree in trees]
+
+def benchmark_spatial_index(n=1_000_000, queries=100, extent=10_000.0):
+    import random
+    import time
+
+    rng = random.Random(0)
+    forest = Forest()
+    for _ in range(n):
+        forest.plant_tree(rng.uniform(0, extent), rng.uniform(0, extent), "Oak", "Green", "Rough")
+    viewports = []
+    for _ in range(queries):
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        viewports.append((x, y, x + extent / 100, y + extent / 100))
+
+    start = time.perf_counter()
+    for x0, y0, x1, y1 in viewports:
+        [t for t in forest.trees if x0 <= t.x <= x1 and y0 <= t.y <= y1]
+    scan = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    for viewport in viewports:
+        forest.query_rect(*viewport)
+    indexed = (time.perf_counter() - start) / queries
+    start = time.perf_counter()
+    for x0, y0, _, _ in viewports:
+        forest.nearest(x0, y0, k=10)
+    nearest = (time.perf_counter() - start) / queries
+    print(f"{n} trees: scan {scan * 1e3:.2f}ms, query_rect {indexed * 1e3:.3f}ms, "
+          f"nearest(10) {nearest * 1e3:.3f}ms per query")
+    return scan, indexed, nearest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class ArrayForest:
+    # Struct-of-arrays Forest: x, y and a TreeFactory type id per tree in
+    # NumPy arrays that grow geometrically. No Tree object is ever created.
+    def __init__(self, capacity=1024, coord_dtype="float64", id_dtype="uint16"):
+        if np is None:
+            raise ImportError("ArrayForest requires numpy")
+        self._size = 0
+        self._xs = np.empty(capacity, dtype=coord_dtype)
+        self._ys = np.empty(capacity, dtype=coord_dtype)
+        self._type_ids = np.empty(capacity, dtype=id_dtype)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def xs(self):
+        return self._xs[:self._size]
+
+    @property
+    def ys(self):
+        return self._ys[:self._size]
+
+    @property
+    def type_ids(self):
+        return self._type_ids[:self._size]
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        capacity = len(self._xs)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = max(capacity * 2, 1)
+        for name in ("_xs", "_ys", "_type_ids"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def plant_tree(self, x, y, name, color, texture):
+        self._reserve(1)
+        i = self._size
+        self._xs[i] = x
+        self._ys[i] = y
+        self._type_ids[i] = TreeFactory.type_id(name, color, texture)
+        self._size += 1
+
+    def plant_trees(self, xs, ys, type_ids):
+        xs, ys, type_ids = np.asarray(xs), np.asarray(ys), np.asarray(type_ids)
+        if not len(xs) == len(ys) == len(type_ids):
+            raise ValueError("xs, ys and type_ids must have the same length")
+        if len(type_ids) and (type_ids.min() < 0 or type_ids.max() >= len(TreeFactory._type_table)):
+            raise ValueError("Unknown tree type id")
+        self._reserve(len(xs))
+        end = self._size + len(xs)
+        self._xs[self._size:end] = xs
+        self._ys[self._size:end] = ys
+        self._type_ids[self._size:end] = type_ids
+        self._size = end
+
+    def draw_batches(self):
+        # One (TreeType, xs, ys) batch per type present: a renderer can
+        # draw each batch with a single call and shared type state.
+        type_ids = self.type_ids
+        order = np.argsort(type_ids, kind="stable")
+        ids, starts = np.unique(type_ids[order], return_index=True)
+        ends = list(starts[1:]) + [len(order)]
+        for type_id, start, end in zip(ids, starts, ends):
+            index = order[start:end]
+            yield TreeFactory.type_by_id(int(type_id)), self.xs[index], self.ys[index]
+
+    def export(self, fileobj):
+        # Tab-separated x, y, type id written straight from the arrays, with
+        # 17 significant digits so coordinates read back exactly.
+        np.savetxt(fileobj, np.column_stack((self.xs, self.ys, self.type_ids)),
+                   fmt=("%.17g", "%.17g", "%d"), delimiter="\t")
 
     def draw(self):
-        return [tree.draw() for tree in self.trees]
+        # Forest.draw for small scenes and comparisons. Coordinates come
+        # back as the column dtype, so an int x planted as 1 draws as 1.0.
+        table = TreeFactory._type_table
+        return [table[t].draw(x, y) for x, y, t in
+                zip(self.xs.tolist(), self.ys.tolist(), self.type_ids.tolist())]
+
+def forest_memory_report(n=1_000_000):
+    import tracemalloc
+
+    types = [("Oak", "Green", "Rough"), ("Pine", "Dark", "Smooth"), ("Birch", "White", "Paper")]
+    report = {}
+    for label in ("Forest", "ArrayForest"):
+        tracemalloc.start()
+        if label == "Forest":
+            forest = Forest()
+            for i in range(n):
+                forest.plant_tree(float(i), float(i), *types[i % 3])
+        else:
+            forest = ArrayForest(capacity=n)
+            ids = np.array([TreeFactory.type_id(*t) for t in types], dtype="uint16")
+            coords = np.arange(n, dtype="float64")
+            forest.plant_trees(coords, coords, ids[np.arange(n) % 3])
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        report[label] = current / n
+        print(f"{label:>12}: {report[label]:.1f} bytes per tree")
+        del forest
+    return report
+
+import json
+import mmap
+import struct
+
+class SceneFile:
+    # Binary Forest scene:
+    #   header   magic, version, record count
+    #   records  fixed-width (x, y, type id) rows, memory-mapped on load
+    # plus a "<path>.types" sidecar: a JSON list of [name, color, texture],
+    # indexed by type id. Appending writes the new records past the
+    # committed ones, then atomically replaces the sidecar (whose list only
+    # ever grows), then rewrites the header count. A crash at any point
+    # leaves the previous scene loadable.
+    MAGIC = b"FRST"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHxxQ")
+
+    def __init__(self, path):
+        self.path = path
+        self.types_path = f"{path}.types"
+        self.record = np.dtype([("x", "<f8"), ("y", "<f8"), ("type_id", "<u2")])
+
+    def _arrays(self, forest):
+        if isinstance(forest, ArrayForest):
+            return forest.xs, forest.ys, forest.type_ids
+        trees = forest.trees
+        xs = np.fromiter((t.x for t in trees), dtype="f8", count=len(trees))
+        ys = np.fromiter((t.y for t in trees), dtype="f8", count=len(trees))
+        ids = np.fromiter((TreeFactory.type_id(t.tree_type.name, t.tree_type.color, t.tree_type.texture)
+                           for t in trees), dtype="u2", count=len(trees))
+        return xs, ys, ids
+
+    def _records(self, xs, ys, type_ids, keys):
+        # Translate TreeFactory ids into this file's type table.
+        index = {key: i for i, key in enumerate(keys)}
+        present = np.unique(type_ids)
+        remap = np.zeros(int(present.max()) + 1 if len(present) else 1, dtype="u2")
+        for type_id in present.tolist():
+            t = TreeFactory.type_by_id(type_id)
+            key = (t.name, t.color, t.texture)
+            if key not in index:
+                index[key] = len(keys)
+                keys.append(key)
+            remap[type_id] = index[key]
+        records = np.empty(len(xs), dtype=self.record)
+        records["x"], records["y"], records["type_id"] = xs, ys, remap[type_ids]
+        return records
+
+    def _read_header(self, f):
+        magic, version, count = self.HEADER.unpack(f.read(self.HEADER.size))
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f"{self.path} is not a version {self.VERSION} Forest scene")
+        with open(self.types_path, encoding="utf-8") as types:
+            keys = [tuple(key) for key in json.load(types)]
+        return count, keys
+
+    def _write_types(self, keys):
+        tmp = f"{self.types_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(keys, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.types_path)
+
+    def _commit(self, f, count, records, keys):
+        f.seek(self.HEADER.size + count * self.record.itemsize)
+        f.write(records.tobytes())
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+        self._write_types(keys)
+        f.seek(0)
+        f.write(self.HEADER.pack(self.MAGIC, self.VERSION, count + len(records)))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def save(self, forest):
+        keys = []
+        records = self._records(*self._arrays(forest), keys)
+        with open(self.path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, 0))
+            self._commit(f, 0, records, keys)
+
+    def append(self, forest):
+        with open(self.path, "r+b") as f:
+            count, keys = self._read_header(f)
+            records = self._records(*self._arrays(forest), keys)
+            self._commit(f, count, records, keys)
+
+    def load(self):
+        # The returned ArrayForest's columns are views into the mapping:
+        # nothing is read until touched. Planting more trees copies the
+        # columns into private arrays first.
+        with open(self.path, "rb") as f:
+            count, keys = self._read_header(f)
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        records = np.frombuffer(mapping, dtype=self.record, count=count, offset=self.HEADER.size)
+        remap = np.array([TreeFactory.type_id(*key) for key in keys], dtype="u2")
+        forest = ArrayForest(capacity=0)
+        forest._xs, forest._ys = records["x"], records["y"]
+        if np.array_equal(remap, np.arange(len(keys))):
+            forest._type_ids = records["type_id"]
+        else:
+            forest._type_ids = remap[records["type_id"]]
+        forest._size = count
+        return forest
 
 #=================
 #=================
@@ -501,26 +1009,160 @@ class Image(ABC):
     def display(self):
         pass
 
+from sdp import FileMapping
+
 class RealImage(Image):
     def __init__(self, filename):
         self.filename = filename
+        self.data = memoryview(b"")
         self.load_from_disk()
 
+    @property
+    def nbytes(self):
+        return len(self.data)
+
     def load_from_disk(self):
         print(f"Loading {self.filename} from disk...")
+        if os.path.isfile(self.filename):
+            self._mapping = FileMapping.open(self.filename)
+            self.data = self._mapping.view
+
+    def slice(self, start, stop):
+        return self.data[start:stop]
 
     def display(self):
         return f"Displaying {self.filename}"
 
+def benchmark_image_loading(path=None, size=2 * 1024 ** 3, touch=1024 * 1024):
+    # Compares read-into-bytes with the shared mapping: time to "load"
+    # and to slice `touch` bytes from the middle of the file.
+    import tempfile
+    import time
+
+    created = path is None
+    if created:
+        fd, path = tempfile.mkstemp(suffix=".img")
+        with os.fdopen(fd, "wb") as f:
+            f.truncate(size)
+    try:
+        middle = os.path.getsize(path) // 2
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            data = f.read()
+        bytes(data[middle:middle + touch])
+        read_seconds = time.perf_counter() - start
+        del data
+
+        start = time.perf_counter()
+        image = RealImage(path)
+        bytes(image.slice(middle, middle + touch))
+        mapped_seconds = time.perf_counter() - start
+        del image
+        print(f"{os.path.getsize(path) / 1024 ** 3:.2f} GiB: read() {read_seconds:.3f}s, "
+              f"mmap {mapped_seconds:.4f}s")
+        return read_seconds, mapped_seconds
+    finally:
+        if created:
+            os.remove(path)
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class ImageCache:
+    # Loaded images shared by every proxy, evicted least recently used
+    # once their nbytes exceed max_bytes. A load already in flight (from
+    # prefetch or another thread) is waited on, never started twice.
+    def __init__(self, max_bytes=256 * 1024 * 1024, loader=RealImage, max_workers=4):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.max_workers = max_workers
+        self._images = OrderedDict()
+        self._loading = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __contains__(self, filename):
+        return filename in self._images
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def peek(self, filename):
+        return self._images.get(filename)
+
+    def _claim(self, filename):
+        # Returns (image, future, owner): a cached image, or the future to
+        # wait on, and whether the caller is responsible for loading it.
+        with self._lock:
+            image = self._images.get(filename)
+            if image is not None:
+                self._images.move_to_end(filename)
+                return image, None, False
+            future = self._loading.get(filename)
+            if future is not None:
+                return None, future, False
+            future = self._loading[filename] = Future()
+            return None, future, True
+
+    def _load(self, filename, future):
+        try:
+            image = self.loader(filename)
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[filename]
+            future.set_exception(exc)
+            return
+        with self._lock:
+            del self._loading[filename]
+            self._images[filename] = image
+            self._bytes += getattr(image, "nbytes", 0)
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= getattr(evicted, "nbytes", 0)
+        future.set_result(image)
+
+    def get(self, filename):
+        image, future, owner = self._claim(filename)
+        if image is not None:
+            return image
+        if owner:
+            self._load(filename, future)
+        return future.result()
+
+    def prefetch(self, filenames):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        futures = []
+        for filename in filenames:
+            image, future, owner = self._claim(filename)
+            if owner:
+                self._executor.submit(self._load, filename, future)
+            if future is not None:
+                futures.append(future)
+        return futures
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
 class ProxyImage(Image):
-    def __init__(self, filename):
+    shared_cache = ImageCache()
+
+    def __init__(self, filename, cache=None):
         self.filename = filename
-        self.real_image = None
+        self.cache = cache if cache is not None else ProxyImage.shared_cache
+
+    @property
+    def real_image(self):
+        return self.cache.peek(self.filename)
 
     def display(self):
-        if self.real_image is None:
-            self.real_image = RealImage(self.filename)
-        return self.real_image.display()
+        return self.cache.get(self.filename).display()
 
 #=================
 #=================
@@ -528,6 +1170,8 @@ class ProxyImage(Image):
 #=================
 #=================
 
+from sdp import PASS, compilable, handle_many
+
 class Handler(ABC):
     def __init__(self):
         self.next_handler = None
@@ -536,23 +1180,53 @@ class Handler(ABC):
         self.next_handler = handler
         return handler
 
-    @abstractmethod
+    def successor(self):
+        return self.next_handler
+
+    def process(self, request):
+        return PASS
+
+    def process_many(self, requests):
+        return [self.process(request) for request in requests]
+
+    def end_of_chain(self, request):
+        return None
+
+    @compilable
     def handle(self, request):
-        pass
+        result = self.process(request)
+        if result is not PASS:
+            return result
+        if self.next_handler:
+            return self.next_handler.handle(request)
+        return self.end_of_chain(request)
+
+    def handle_many(self, requests, **options):
+        return handle_many(self, requests, **options)
 
 class AuthHandler(Handler):
-    def handle(self, request):
-        if request.get("authenticated"):
-            return self.next_handler.handle(request) if self.next_handler else "Request handled"
-        return "Authentication Failed"
+    def process(self, request):
+        return PASS if request.get("authenticated") else "Authentication Failed"
+
+    def end_of_chain(self, request):
+        return "Request handled"
 
 class LogHandler(Handler):
-    def handle(self, request):
+    def process(self, request):
         print("Logging request...")
-        return self.next_handler.handle(request) if self.next_handler else "Request logged"
+        return PASS
+
+    def process_many(self, requests):
+        # One buffered write per chunk instead of one print per request.
+        if requests:
+            print("\n".join(["Logging request..."] * len(requests)))
+        return [PASS] * len(requests)
+
+    def end_of_chain(self, request):
+        return "Request logged"
 
 class DataHandler(Handler):
-    def handle(self, request):
+    def process(self, request):
         return f"Data processed for {request.get('user')}"
 
 #=================
@@ -562,6 +1236,11 @@ class DataHandler(Handler):
 #=================
 
 class Command(ABC):
+    # Commands with the same non-None coalesce_key are redundant: only the
+    # last one queued on a CommandBus needs to run.
+    receiver = None
+    coalesce_key = None
+
     @abstractmethod
     def execute(self):
         pass
@@ -573,23 +1252,103 @@ class Light:
     def off(self):
         return "Light is OFF"
 
-class LightOnCommand(Command):
+class LightCommand(Command):
     def __init__(self, light: Light):
         self.light = light
 
+    @property
+    def receiver(self):
+        return self.light
+
+    @property
+    def coalesce_key(self):
+        # ON and OFF both set the light's power, so the last one wins.
+        return (id(self.light), "power")
+
+class LightOnCommand(LightCommand):
     def execute(self):
         return self.light.on()
 
-class LightOffCommand(Command):
-    def __init__(self, light: Light):
-        self.light = light
-
+class LightOffCommand(LightCommand):
     def execute(self):
         return self.light.off()
 
+class CommandBus:
+    # Queues commands and runs them in batches: optionally coalesced, then
+    # grouped per receiver so each receiver's commands run in order on one
+    # worker while different receivers run in parallel.
+    def __init__(self, executor=None, coalesce=True):
+        self.executor = executor
+        self.coalesce = coalesce
+        self._queue = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.executed = 0
+
+    def submit(self, command: Command):
+        with self._lock:
+            self._queue.append(command)
+            self.submitted += 1
+
+    def submit_many(self, commands):
+        commands = list(commands)
+        with self._lock:
+            self._queue.extend(commands)
+            self.submitted += len(commands)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _drain(self):
+        with self._lock:
+            commands, self._queue = self._queue, []
+        if not self.coalesce:
+            return commands
+        keys = [command.coalesce_key for command in commands]
+        last = {key: position for position, key in enumerate(keys) if key is not None}
+        return [command for position, (command, key) in enumerate(zip(commands, keys))
+                if key is None or last[key] == position]
+
+    def _batches(self, commands):
+        groups = {}
+        for position, command in enumerate(commands):
+            groups.setdefault(id(command.receiver), []).append((position, command))
+        return list(groups.values())
+
+    @staticmethod
+    def _run_batch(batch):
+        return [(position, command.execute()) for position, command in batch]
+
+    def _collect(self, commands, batch_results):
+        results = [None] * len(commands)
+        for batch in batch_results:
+            for position, result in batch:
+                results[position] = result
+        self.executed += len(commands)
+        return results
+
+    def flush(self):
+        commands = self._drain()
+        batches = self._batches(commands)
+        if self.executor is None:
+            done = [self._run_batch(batch) for batch in batches]
+        else:
+            done = list(self.executor.map(self._run_batch, batches))
+        return self._collect(commands, done)
+
+    async def flush_async(self):
+        import asyncio
+
+        commands = self._drain()
+        loop = asyncio.get_running_loop()
+        done = await asyncio.gather(*(loop.run_in_executor(self.executor, self._run_batch, batch)
+                                      for batch in self._batches(commands)))
+        return self._collect(commands, done)
+
 class RemoteControl:
-    def __init__(self):
+    def __init__(self, bus=None):
         self.command = None
+        self.bus = bus if bus is not None else CommandBus()
 
     def set_command(self, command: Command):
         self.command = command
@@ -597,6 +1356,30 @@ class RemoteControl:
     def press_button(self):
         return self.command.execute()
 
+    def queue_button(self):
+        self.bus.submit(self.command)
+
+    def run_queued(self):
+        return self.bus.flush()
+
+def benchmark_command_bus(n=1_000_000, lights=100):
+    import random
+    import time
+
+    rng = random.Random(0)
+    receivers = [Light() for _ in range(lights)]
+    commands = [rng.choice((LightOnCommand, LightOffCommand))(rng.choice(receivers)) for _ in range(n)]
+    results = {}
+    for coalesce in (False, True):
+        bus = CommandBus(coalesce=coalesce)
+        bus.submit_many(commands)
+        start = time.perf_counter()
+        executed = len(bus.flush())
+        elapsed = time.perf_counter() - start
+        results[coalesce] = n / elapsed
+        print(f"coalesce={coalesce!s:>5}: {executed} executed, {results[coalesce]:,.0f} commands/s")
+    return results
+
 
 #=================
 #=================
@@ -609,6 +1392,19 @@ class Expression(ABC):
     def interpret(self, context):
         pass
 
+    def interpret_batch(self, contexts):
+        # contexts maps each variable name to a NumPy column, one row per
+        # context. Nodes without a vectorized form are evaluated row by row.
+        # Constants come back as 0-d arrays that broadcast against columns,
+        # so an expression without variables still yields its value.
+        if np is None:
+            raise ImportError("interpret_batch requires numpy")
+        if not contexts:
+            return np.asarray(self.interpret({}))
+        names = list(contexts)
+        rows = zip(*(contexts[name] for name in names))
+        return np.array([self.interpret(dict(zip(names, row))) for row in rows])
+
 class Number(Expression):
     def __init__(self, number):
         self.number = number
@@ -616,6 +1412,9 @@ class Number(Expression):
     def interpret(self, context):
         return self.number
 
+    def interpret_batch(self, contexts):
+        return np.asarray(self.number)
+
 class Add(Expression):
     def __init__(self, left: Expression, right: Expression):
         self.left = left
@@ -624,6 +1423,9 @@ class Add(Expression):
     def interpret(self, context):
         return self.left.interpret(context) + self.right.interpret(context)
 
+    def interpret_batch(self, contexts):
+        return self.left.interpret_batch(contexts) + self.right.interpret_batch(contexts)
+
 class Subtract(Expression):
     def __init__(self, left: Expression, right: Expression):
         self.left = left
@@ -632,6 +1434,207 @@ class Subtract(Expression):
     def interpret(self, context):
         return self.left.interpret(context) - self.right.interpret(context)
 
+    def interpret_batch(self, contexts):
+        return self.left.interpret_batch(contexts) - self.right.interpret_batch(contexts)
+
+class Variable(Expression):
+    def __init__(self, name):
+        self.name = name
+
+    def interpret(self, context):
+        return context[self.name]
+
+    def interpret_batch(self, contexts):
+        return np.asarray(contexts[self.name])
+
+import ast
+import operator
+import weakref
+
+_BINARY_NODES = {Add: (ast.Add, operator.add), Subtract: (ast.Sub, operator.sub)}
+_compiled_expressions = weakref.WeakKeyDictionary()
+
+class _ExpressionCompiler:
+    # Lowers an expression tree to one Python function. Constant subtrees
+    # are folded to a single value first; node types it does not know are
+    # kept by calling their own interpret(context).
+    def __init__(self):
+        self.namespace = {}
+
+    def _bind(self, value):
+        name = f"_k{len(self.namespace)}"
+        self.namespace[name] = value
+        return ast.Name(id=name, ctx=ast.Load())
+
+    def _constant(self, value):
+        if type(value) in (int, float, complex, bool, str, type(None)):
+            return ast.Constant(value)
+        return self._bind(value)
+
+    def fold(self, expr):
+        # Returns ("const", value) or ("node", ast expression).
+        kind = type(expr)
+        if kind is Number:
+            return "const", expr.number
+        if kind is Variable:
+            key = ast.Constant(expr.name)
+            return "node", ast.Subscript(value=ast.Name(id="context", ctx=ast.Load()), slice=key, ctx=ast.Load())
+        if kind in _BINARY_NODES:
+            op, evaluate = _BINARY_NODES[kind]
+            left, right = self.fold(expr.left), self.fold(expr.right)
+            if left[0] == right[0] == "const":
+                return "const", evaluate(left[1], right[1])
+            return "node", ast.BinOp(left=self.lower(left), op=op(), right=self.lower(right))
+        method = ast.Attribute(value=self._bind(expr), attr="interpret", ctx=ast.Load())
+        return "node", ast.Call(func=method, args=[ast.Name(id="context", ctx=ast.Load())], keywords=[])
+
+    def lower(self, folded):
+        kind, value = folded
+        return self._constant(value) if kind == "const" else value
+
+    def compile(self, expr):
+        body = self.lower(self.fold(expr))
+        function = ast.FunctionDef(
+            name="compiled_expression",
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg="context")], kwonlyargs=[],
+                               kw_defaults=[], defaults=[ast.Constant(None)]),
+            body=[ast.Return(value=body)], decorator_list=[])
+        module = ast.fix_missing_locations(ast.Module(body=[function], type_ignores=[]))
+        exec(compile(module, "<expression>", "exec"), self.namespace)
+        return self.namespace["compiled_expression"]
+
+def compile_expression(expr):
+    # Cached per tree object: edit a tree after compiling it and the cached
+    # function goes stale, so build a new tree instead. A root of unknown
+    # type is not cached: its function calls back into the root, and that
+    # strong reference would keep the WeakKeyDictionary key alive forever.
+    compiled = _compiled_expressions.get(expr)
+    if compiled is None:
+        compiled = _ExpressionCompiler().compile(expr)
+        if type(expr) in (Number, Variable) or type(expr) in _BINARY_NODES:
+            _compiled_expressions[expr] = compiled
+    return compiled
+
+def benchmark_compiled_expression(calls=1_000_000):
+    import timeit
+
+    expr = Number(0)
+    for i in range(10):
+        expr = Add(expr, Subtract(Variable("x"), Add(Number(i), Number(1))))
+    compiled = compile_expression(expr)
+    context = {"x": 7}
+    assert compiled(context) == expr.interpret(context)
+    walked = timeit.timeit(lambda: expr.interpret(context), number=calls)
+    fast = timeit.timeit(lambda: compiled(context), number=calls)
+    print(f"interpret {walked:.3f}s, compiled {fast:.3f}s for {calls} calls ({walked / fast:.1f}x)")
+    return walked, fast
+
+import functools
+import re
+
+_TOKEN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|([A-Za-z_]\w*)|(.))")
+_interned = weakref.WeakValueDictionary()
+
+def _intern(key, build):
+    # Hash-consing: structurally equal subexpressions share one node.
+    node = _interned.get(key)
+    if node is None:
+        node = _interned[key] = build()
+    return node
+
+def _tokenize(text):
+    tokens = []
+    for match in _TOKEN.finditer(text):
+        number, name, symbol = match.groups()
+        if number is not None:
+            tokens.append(("num", float(number) if "." in number else int(number), match.start(1)))
+        elif name is not None:
+            tokens.append(("name", name, match.start(2)))
+        elif symbol is not None and not symbol.isspace():
+            if symbol not in "+-()":
+                raise ValueError(f"Unexpected {symbol!r} at position {match.start(3)} in {text!r}")
+            tokens.append((symbol, symbol, match.start(3)))
+    tokens.append(("end", None, len(text)))
+    return tokens
+
+class _Parser:
+    # expr := term (("+" | "-") term)*
+    # term := number | name | "(" expr ")"
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def _take(self, kind=None):
+        token = self.tokens[self.pos]
+        if kind is not None and token[0] != kind:
+            raise ValueError(f"Expected {kind!r} at position {token[2]} in {self.text!r}")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        expr = self.expr()
+        self._take("end")
+        return expr
+
+    def expr(self):
+        left = self.term()
+        while self.tokens[self.pos][0] in ("+", "-"):
+            op = Add if self._take()[0] == "+" else Subtract
+            right = self.term()
+            left = _intern((op, id(left), id(right)), functools.partial(op, left, right))
+        return left
+
+    def term(self):
+        kind, value, position = self._take()
+        if kind == "num":
+            return _intern((Number, type(value), value), functools.partial(Number, value))
+        if kind == "name":
+            return _intern((Variable, value), functools.partial(Variable, value))
+        if kind == "(":
+            expr = self.expr()
+            self._take(")")
+            return expr
+        raise ValueError(f"Unexpected {value or 'end of input'!r} at position {position} in {self.text!r}")
+
+@functools.lru_cache(maxsize=4096)
+def parse_expression(text):
+    # Returned trees are shared between callers (and between identical
+    # subexpressions), so treat them as read-only.
+    return _Parser(text).parse()
+
+def benchmark_parse(rules=1000, lookups=100_000):
+    import random
+    import time
+
+    rng = random.Random(0)
+    texts = [" + ".join(f"(x - {rng.randrange(100)})" for _ in range(8)) for _ in range(rules)]
+    parse_expression.cache_clear()
+    start = time.perf_counter()
+    for text in texts:
+        _Parser(text).parse()
+    cold = rules / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        parse_expression(rng.choice(texts))
+    warm = lookups / (time.perf_counter() - start)
+    info = parse_expression.cache_info()
+    hit_rate = info.hits / (info.hits + info.misses)
+    print(f"uncached {cold:,.0f} rules/s, cached {warm:,.0f} rules/s, "
+          f"hit rate {hit_rate:.1%}, {len(_interned)} shared nodes")
+    return cold, warm, hit_rate
+
+def benchmark_interpret_batch(rows=1_000_000):
+    import time
+
+    expr = Subtract(Add(Variable("x"), Number(3)), Variable("y"))
+    columns = {"x": np.arange(rows, dtype="int64"), "y": np.arange(rows, dtype="int64") // 2}
+    start = time.perf_counter()
+    expr.interpret_batch(columns)
+    elapsed = time.perf_counter() - start
+    print(f"{rows} rows in {elapsed:.4f}s ({rows / elapsed:,.0f} rows/s)")
+    return elapsed
+
 #=================
 #=================
 # Iterator Pattern
@@ -648,37 +1651,463 @@ class Iterator(ABC):
         pass
 
 class NameIterator(Iterator):
-    def __init__(self, names):
+    def __init__(self, names, start=0, stop=None):
         self._names = names
-        self._index = 0
+        self._index = start
+        self._stop = len(names) if stop is None else stop
 
     def has_next(self):
-        return self._index < len(self._names)
+        return self._index < self._stop
 
     def next(self):
-        if self.has_next():
+        return self.__next__()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._index < self._stop:
             name = self._names[self._index]
             self._index += 1
             return name
         raise StopIteration
 
 class NameRepository:
-    def __init__(self):
-        self.names = ["Alice", "Bob", "Charlie"]
+    def __init__(self, names=None):
+        self.names = ["Alice", "Bob", "Charlie"] if names is None else names
 
     def get_iterator(self):
         return NameIterator(self.names)
 
+    def __iter__(self):
+        return self.get_iterator()
+
+    def shards(self, n):
+        # n iterators over disjoint, contiguous index ranges.
+        size = len(self.names)
+        bounds = [size * i // n for i in range(n + 1)]
+        return [NameIterator(self.names, bounds[i], bounds[i + 1]) for i in range(n)]
+
+import itertools
+
+class NameCursor:
+    # Iterator over a StreamingNameRepository that remembers where it is.
+    # `position` is a byte offset for file sources and an item count for
+    # generator sources; pass it to StreamingNameRepository.cursor() to
+    # pick up again later, even in another process.
+    def __init__(self, repository, position=0):
+        self.repository = repository
+        self.position = position
+        self._names = repository._open(position)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        name, self.position = next(self._names)
+        return name
+
+    def iter_chunks(self, size):
+        while True:
+            chunk = list(itertools.islice(self, size))
+            if not chunk:
+                return
+            yield chunk
+
+class StreamingNameRepository:
+    # Names streamed lazily from a file (one per line) or from a callable
+    # returning a fresh iterable, so memory use does not depend on how
+    # many names the source holds.
+    def __init__(self, source, encoding="utf-8"):
+        self.source = source
+        self.encoding = encoding
+
+    def _open(self, position):
+        if isinstance(self.source, (str, bytes, os.PathLike)):
+            return self._read_file(position)
+        return self._read_iterable(position)
+
+    def _read_file(self, offset):
+        with open(self.source, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                name = line.rstrip(b"\r\n")
+                if name:
+                    yield name.decode(self.encoding), offset
+
+    def _read_iterable(self, start):
+        names = self.source() if callable(self.source) else self.source
+        for count, name in enumerate(itertools.islice(names, start, None), start + 1):
+            yield name, count
+
+    def cursor(self, position=0):
+        return NameCursor(self, position)
+
+    def __iter__(self):
+        return self.cursor()
+
+    def get_iterator(self):
+        return self.cursor()
+
+    def iter_chunks(self, size):
+        return self.cursor().iter_chunks(size)
+
+    def shards(self, n):
+        # Split a file source into n byte ranges, each moved forward to the
+        # next line start so that every name lands in exactly one shard.
+        if not isinstance(self.source, (str, bytes, os.PathLike)):
+            raise TypeError("only file sources can be sharded")
+        size = os.path.getsize(self.source)
+        bounds = [0]
+        with open(self.source, "rb") as f:
+            for i in range(1, n):
+                offset = max(size * i // n, bounds[-1])
+                if offset > 0:
+                    f.seek(offset - 1)
+                    f.readline()
+                    offset = f.tell()
+                bounds.append(min(offset, size))
+        bounds.append(size)
+        return [NameShard(self.source, bounds[i], bounds[i + 1], self.encoding) for i in range(n)]
+
+class NameShard:
+    # Picklable iterable over the names in bytes [start, stop) of a file;
+    # shards are what get shipped to worker processes.
+    def __init__(self, path, start, stop, encoding="utf-8"):
+        self.path = path
+        self.start = start
+        self.stop = stop
+        self.encoding = encoding
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.start)
+            offset = self.start
+            for line in f:
+                if offset >= self.stop:
+                    return
+                offset += len(line)
+                name = line.rstrip(b"\r\n")
+                if name:
+                    yield name.decode(self.encoding)
+
+def map_shards(repository, func, workers=None, ordered=True, executor=None):
+    # Runs func(shard) for one shard per worker in a process pool. With
+    # ordered=True results come back in shard order, so concatenating
+    # them reproduces a sequential scan; otherwise as each finishes.
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workers = workers or os.cpu_count() or 1
+    shards = repository.shards(workers)
+    own = executor is None
+    executor = executor or ProcessPoolExecutor(max_workers=workers)
+    try:
+        if ordered:
+            yield from executor.map(func, shards)
+        else:
+            for future in as_completed([executor.submit(func, shard) for shard in shards]):
+                yield future.result()
+    finally:
+        if own:
+            executor.shutdown()
+
+def _count_names(shard):
+    count = length = 0
+    for name in shard:
+        count += 1
+        length += len(name)
+    return count, length
+
+def benchmark_sharded_scan(path, workers=None):
+    # path: a large file with one name per line (e.g. several GB).
+    import time
+
+    repository = StreamingNameRepository(path)
+    start = time.perf_counter()
+    sequential = _count_names(repository)
+    single = time.perf_counter() - start
+    start = time.perf_counter()
+    parts = list(map_shards(repository, _count_names, workers))
+    parallel = time.perf_counter() - start
+    assert tuple(map(sum, zip(*parts))) == sequential
+    print(f"{sequential[0]} names: 1 core {single:.2f}s, {len(parts)} shards {parallel:.2f}s "
+          f"({single / parallel:.1f}x)")
+    return single, parallel
+
 #=================
 #=================
 # Mediator Pattern
 #=================
 #=================
 
+import bisect
+import time
+from array import array
+
+from sdp import MessageBus
+
+class ChatSegment:
+    # One time bucket of the history log, stored column by column:
+    # timestamps, UTF-8 text offsets, user ids and the text bytes. Segments
+    # are filled in memory; once saved they are reopened as read-only views
+    # into a memory-mapped file.
+    MAGIC = b"CHSG"
+    HEADER = struct.Struct("<4sxxxxqQQQ")
+
+    def __init__(self, bucket, first_id):
+        self.bucket = bucket
+        self.first_id = first_id
+        self.timestamps = array("d")
+        self.offsets = array("Q", [0])
+        self.user_ids = array("I")
+        self.text = bytearray()
+        self.path = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def append(self, timestamp, user_id, text):
+        self.timestamps.append(timestamp)
+        self.user_ids.append(user_id)
+        self.text += text.encode("utf-8")
+        self.offsets.append(len(self.text))
+
+    def message(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.timestamps[i], self.user_ids[i], bytes(self.text[start:end]).decode("utf-8")
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.bucket, self.first_id, len(self), len(self.text)))
+            for column in (self.timestamps, self.offsets, self.user_ids, self.text):
+                f.write(column)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        magic, bucket, first_id, count, text_size = cls.HEADER.unpack_from(view)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a ChatRoom history segment")
+        segment = cls(bucket, first_id)
+        offset = cls.HEADER.size
+        columns = []
+        for code, length in (("d", count), ("Q", count + 1), ("I", count)):
+            end = offset + length * array(code).itemsize
+            columns.append(view[offset:end].cast(code))
+            offset = end
+        segment.timestamps, segment.offsets, segment.user_ids = columns
+        segment.text = view[offset:offset + text_size]
+        segment.path = path
+        return segment
+
+class ChatHistory:
+    # Append-only, columnar message log split into time-bucketed segments,
+    # with posting lists (sorted message ids) per user and per keyword.
+    # Timestamps never go backwards, so time ranges map to contiguous id
+    # ranges and every lookup is a bisect instead of a scan. With a
+    # directory, each finished segment is written there and memory-mapped;
+    # close() (or leaving a with block) writes the open one. open() loads
+    # such a directory, or starts an empty one, and rebuilds the indexes.
+    WORD = re.compile(r"\w+")
+
+    def __init__(self, bucket_seconds=3600.0, directory=None):
+        self.bucket_seconds = bucket_seconds
+        self.directory = directory
+        self._segments = []
+        self._first_ids = []
+        self._first_times = []
+        self._users = []
+        self._user_ids = {}
+        self._by_user = {}
+        self._by_word = {}
+        self._count = 0
+        self._last_time = float("-inf")
+
+    @classmethod
+    def open(cls, directory, bucket_seconds=3600.0):
+        history = cls(bucket_seconds, directory)
+        os.makedirs(directory, exist_ok=True)
+        users = os.path.join(directory, "users.json")
+        if os.path.exists(users):
+            with open(users, encoding="utf-8") as f:
+                for name in json.load(f):
+                    history._user_id(name)
+        paths = sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+        for name in paths:
+            segment = ChatSegment.load(os.path.join(directory, name))
+            if segment.first_id != history._count:
+                raise ValueError(f"{directory} has a gap before segment {name}")
+            history._add_segment(segment)
+            for i in range(len(segment)):
+                timestamp, user_id, text = segment.message(i)
+                history._index(history._count, user_id, text)
+                history._count += 1
+                history._last_time = timestamp
+        return history
+
+    def __len__(self):
+        return self._count
+
+    def _user_id(self, name):
+        user_id = self._user_ids.get(name)
+        if user_id is None:
+            user_id = self._user_ids[name] = len(self._users)
+            self._users.append(name)
+        return user_id
+
+    def _add_segment(self, segment):
+        self._segments.append(segment)
+        self._first_ids.append(segment.first_id)
+        self._first_times.append(segment.timestamps[0] if len(segment) else self._last_time)
+
+    def _index(self, message_id, user_id, text):
+        self._by_user.setdefault(user_id, array("Q")).append(message_id)
+        for word in set(self.WORD.findall(text.lower())):
+            self._by_word.setdefault(word, array("Q")).append(message_id)
+
+    def append(self, user, text, timestamp=None):
+        if timestamp is None:
+            timestamp = max(time.time(), self._last_time)
+        if timestamp < self._last_time:
+            raise ValueError("ChatHistory timestamps must not go backwards")
+        bucket = int(timestamp // self.bucket_seconds)
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment.bucket != bucket or segment.path is not None:
+            self.flush()
+            segment = ChatSegment(bucket, self._count)
+            self._add_segment(segment)
+            self._first_times[-1] = timestamp
+        user_id = self._user_id(user)
+        segment.append(timestamp, user_id, text)
+        message_id = self._count
+        self._index(message_id, user_id, text)
+        self._count += 1
+        self._last_time = timestamp
+        return message_id
+
+    def flush(self):
+        # Write the open segment to disk and swap in its mapped copy.
+        if self.directory is None or not self._segments:
+            return
+        segment = self._segments[-1]
+        if segment.path is not None or not len(segment):
+            return
+        path = os.path.join(self.directory, f"{segment.first_id:012d}.seg")
+        segment.save(path)
+        with open(os.path.join(self.directory, "users.json"), "w", encoding="utf-8") as f:
+            json.dump(self._users, f)
+        self._segments[-1] = ChatSegment.load(path)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __getitem__(self, message_id):
+        if message_id < 0:
+            message_id += self._count
+        if not 0 <= message_id < self._count:
+            raise IndexError("message id out of range")
+        i = bisect.bisect_right(self._first_ids, message_id) - 1
+        segment = self._segments[i]
+        timestamp, user_id, text = segment.message(message_id - segment.first_id)
+        return timestamp, self._users[user_id], text
+
+    def _first_at(self, timestamp):
+        # Id of the first message sent at or after timestamp.
+        if timestamp is None:
+            return 0
+        i = bisect.bisect_left(self._first_times, timestamp)
+        if i:
+            segment = self._segments[i - 1]
+            j = bisect.bisect_left(segment.timestamps, timestamp)
+            if j < len(segment):
+                return segment.first_id + j
+        return self._first_ids[i] if i < len(self._segments) else self._count
+
+    def _id_range(self, start, end):
+        return self._first_at(start), self._count if end is None else self._first_at(end)
+
+    def between(self, start=None, end=None):
+        # Messages with start <= timestamp < end.
+        lo, hi = self._id_range(start, end)
+        return [self[i] for i in range(lo, hi)]
+
+    def _clip(self, postings, lo, hi):
+        return postings[bisect.bisect_left(postings, lo):bisect.bisect_left(postings, hi)]
+
+    def by_user(self, user, start=None, end=None):
+        postings = self._by_user.get(self._user_ids.get(user))
+        if postings is None:
+            return []
+        return [self[i] for i in self._clip(postings, *self._id_range(start, end))]
+
+    def search(self, query, user=None, start=None, end=None, limit=None):
+        # Messages containing every word of query, oldest first. The
+        # shortest posting list drives the intersection; the others are
+        # probed by bisect, so cost follows the rarest term.
+        postings = [self._by_word.get(word) for word in set(self.WORD.findall(query.lower()))]
+        if user is not None:
+            postings.append(self._by_user.get(self._user_ids.get(user)))
+        if not postings or any(p is None for p in postings):
+            return []
+        lo, hi = self._id_range(start, end)
+        postings.sort(key=len)
+        matches = []
+        for message_id in self._clip(postings[0], lo, hi):
+            for other in postings[1:]:
+                i = bisect.bisect_left(other, message_id)
+                if i == len(other) or other[i] != message_id:
+                    break
+            else:
+                matches.append(self[message_id])
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
+
 class ChatRoom:
+    # Messages are published on "room:<name>"; direct messages go to
+    # "user:<name>", so delivery only reaches the users subscribed there.
+    # Pass a ChatHistory to record every shown message in it.
+    def __init__(self, name="lobby", bus=None, history=None):
+        self.name = name
+        self.bus = bus if bus is not None else MessageBus()
+        self.history = history
+
+    @property
+    def topic(self):
+        return f"room:{self.name}"
+
     def show_message(self, user, message):
+        if self.history is not None:
+            self.history.append(user.name, message)
         return f"[{user.name}]: {message}"
 
+    def join(self, user, maxsize=1024, policy="drop_oldest"):
+        return self.bus.subscribe(user, [self.topic, f"user:{user.name}"], maxsize, policy)
+
+    async def post(self, user, message):
+        text = self.show_message(user, message)
+        await self.bus.publish(self.topic, text)
+        return text
+
+    async def post_many(self, user, messages):
+        texts = [self.show_message(user, message) for message in messages]
+        await self.bus.publish_batch(self.topic, texts)
+        return texts
+
+    async def direct(self, user, recipient, message):
+        text = self.show_message(user, message)
+        await self.bus.publish(f"user:{recipient}", text)
+        return text
+
 class User:
     def __init__(self, name, chatroom: ChatRoom):
         self.name = name
@@ -687,6 +2116,9 @@ class User:
     def send_message(self, message):
         return self.chatroom.show_message(self, message)
 
+    async def post_message(self, message):
+        return await self.chatroom.post(self, message)
+
 
 #=================
 #=================
@@ -717,15 +2149,113 @@ class Originator:
     def get_state(self):
         return self._state
 
+from sdp import HistoryStore
+
 class Caretaker:
-    def __init__(self):
-        self._memento_list = []
+    # Mementos are unpacked into a bounded, delta-encoded HistoryStore and
+    # rebuilt on get(); anything else added is stored and returned as is.
+    def __init__(self, capacity=None, keyframe_interval=32, compress_after=None):
+        self._history = HistoryStore(capacity, keyframe_interval, compress_after)
+
+    def add(self, state):
+        if isinstance(state, Memento):
+            self._history.append(state.get_state(), wrap=Memento)
+        else:
+            self._history.append(state)
+
+    def get(self, index):
+        return self._history.get(index)
+
+    def __len__(self):
+        return len(self._history)
+
+import pickle
+
+class DiskCaretaker:
+    # Caretaker that spills every state to an append-only log of
+    # length-prefixed pickles. Only the record offsets live in memory;
+    # get(i) unpickles just record i out of a read-only mapping of the
+    # file, behind a small LRU cache of hot records' pickled bytes. Reopening the same
+    # path rebuilds the offset index, so histories survive restarts.
+    RECORD = struct.Struct("<Q")
+
+    def __init__(self, path, cache_size=128):
+        self.path = path
+        self.cache_size = cache_size
+        self._offsets = array("Q")
+        self._cache = OrderedDict()
+        self._mapping = None
+        self._lock = threading.Lock()
+        self._scan()
+        self._file = open(path, "ab")
+
+    def _scan(self):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        with open(self.path, "r+b") as f:
+            offset = 0
+            while offset + self.RECORD.size <= size:
+                f.seek(offset)
+                (length,) = self.RECORD.unpack(f.read(self.RECORD.size))
+                end = offset + self.RECORD.size + length
+                if end > size:
+                    break
+                self._offsets.append(offset)
+                offset = end
+            if offset != size:
+                f.truncate(offset)  # drop a record torn by a crash mid-append
 
     def add(self, state):
-        self._memento_list.append(state)
+        if isinstance(state, Memento):
+            record = (True, state.get_state())
+        else:
+            record = (False, state)
+        payload = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._offsets.append(self._file.tell())
+            self._file.write(self.RECORD.pack(len(payload)))
+            self._file.write(payload)
+            self._file.flush()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def _view(self, end):
+        # Remap only when asked for bytes past the current mapping.
+        if self._mapping is None or len(self._mapping) < end:
+            with open(self.path, "rb") as f:
+                self._mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mapping
 
     def get(self, index):
-        return self._memento_list[index]
+        if index < 0:
+            index += len(self._offsets)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError("memento index out of range")
+        with self._lock:
+            payload = self._cache.get(index)
+            if payload is not None:
+                self._cache.move_to_end(index)
+            else:
+                offset = self._offsets[index]
+                start = offset + self.RECORD.size
+                view = self._view(start)
+                (length,) = self.RECORD.unpack_from(view, offset)
+                view = self._view(start + length)
+                payload = view[start:start + length]
+                self._cache[index] = payload
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        # Unpickle on every call so each caller gets a private copy.
+        is_memento, state = pickle.loads(payload)
+        return Memento(state) if is_memento else state
+
+    def close(self):
+        self._file.close()
+        if self._mapping is not None:
+            self._mapping.close()
+            self._mapping = None
 
 #=================
 #=================
@@ -746,13 +2276,59 @@ class Subject(ABC):
     def notify(self):
         pass
 
+class ObserverRegistry:
+    # Insertion-ordered set of observers keyed by identity, so attach and
+    # detach are O(1). With weak=True only weak references are held and
+    # an observer drops out as soon as it is garbage collected.
+    def __init__(self, weak=False):
+        self.weak = weak
+        self._entries = {}
+
+    def _prune(self, key, ref):
+        # id() values are reused, so only remove the entry this ref owns.
+        if self._entries.get(key) is ref:
+            del self._entries[key]
+
+    def add(self, observer):
+        key = id(observer)
+        if key in self._entries:
+            return
+        if self.weak:
+            self._entries[key] = weakref.ref(observer, lambda ref, key=key: self._prune(key, ref))
+        else:
+            self._entries[key] = observer
+
+    def remove(self, observer):
+        try:
+            del self._entries[id(observer)]
+        except KeyError:
+            raise ValueError("observer is not attached") from None
+
+    def __contains__(self, observer):
+        return id(observer) in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        # Iterates a snapshot: observers may attach or detach (themselves
+        # or others) mid-iteration. Ones detached before their turn are
+        # skipped; ones attached are seen from the next pass on.
+        entries = self._entries
+        for key, entry in list(entries.items()):
+            if entries.get(key) is not entry:
+                continue
+            observer = entry() if self.weak else entry
+            if observer is not None:
+                yield observer
+
 class ConcreteSubject(Subject):
-    def __init__(self):
-        self._observers = []
+    def __init__(self, weak=False):
+        self._observers = ObserverRegistry(weak)
         self._state = None
 
     def attach(self, observer):
-        self._observers.append(observer)
+        self._observers.add(observer)
 
     def detach(self, observer):
         self._observers.remove(observer)
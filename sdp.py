@@ -20,7 +20,44 @@ class Cat(Animal):
         return "Meow!"
 
 class AnimalFactory:
+    _creators = {"dog": Dog, "cat": Cat}
+
+    def __init__(self, pooled=False):
+        # Dog/Cat carry no state, so a pooled factory can hand out one
+        # shared instance per type instead of allocating on every call.
+        self.pooled = pooled
+        self._pool = {}
+
+    @classmethod
+    def register(cls, animal_type, creator):
+        if "_creators" not in cls.__dict__:
+            cls._creators = dict(cls._creators)
+        cls._creators[animal_type] = creator
+
+    def _creator(self, animal_type):
+        try:
+            return self._creators[animal_type]
+        except KeyError:
+            raise ValueError("Unknown animal type") from None
+
     def create_animal(self, animal_type):
+        if self.pooled:
+            animal = self._pool.get(animal_type)
+            if animal is None:
+                animal = self._pool[animal_type] = self._creator(animal_type)()
+            return animal
+        return self._creator(animal_type)()
+
+    def create_many(self, animal_type, n):
+        if self.pooled:
+            return [self.create_animal(animal_type)] * n
+        creator = self._creator(animal_type)
+        return [creator() for _ in range(n)]
+
+def benchmark_animal_factory(n=1_000_000):
+    import timeit
+
+    def create_branching(animal_type):
         if animal_type == "dog":
             return Dog()
         elif animal_type == "cat":
@@ -28,6 +65,18 @@ class AnimalFactory:
         else:
             raise ValueError("Unknown animal type")
 
+    factory = AnimalFactory()
+    pooled = AnimalFactory(pooled=True)
+    results = {
+        "if/elif": timeit.timeit(lambda: [create_branching("cat") for _ in range(n)], number=1),
+        "dict dispatch": timeit.timeit(lambda: [factory.create_animal("cat") for _ in range(n)], number=1),
+        "create_many": timeit.timeit(lambda: factory.create_many("cat", n), number=1),
+        "create_many pooled": timeit.timeit(lambda: pooled.create_many("cat", n), number=1),
+    }
+    for name, seconds in results.items():
+        print(f"{name:>20}: {seconds:.3f}s for {n} animals")
+    return results
+
 #=================
 #=================
 # Abstract Factory Design Pattern
@@ -66,13 +115,61 @@ class MacFactory(GUIFactory):
 #=================
 #=================
 
-class Singleton:
-    _instance = None
+import os
+import threading
+
+class SingletonMeta(type):
+    _instances = {}
+    _lock = threading.RLock()
+
+    def __call__(cls, *args, **kwargs):
+        # Hot path: a plain dict read, no lock once the instance exists.
+        # The lock is reentrant so a singleton's __init__ may create others.
+        try:
+            return SingletonMeta._instances[cls]
+        except KeyError:
+            pass
+        with SingletonMeta._lock:
+            if cls not in SingletonMeta._instances:
+                SingletonMeta._instances[cls] = super().__call__(*args, **kwargs)
+            return SingletonMeta._instances[cls]
+
+    @staticmethod
+    def reset():
+        SingletonMeta._instances = {}
+        SingletonMeta._lock = threading.RLock()
+
+# A forked child must not inherit the parent's instances, or a lock that
+# another parent thread happened to hold at fork time.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=SingletonMeta.reset)
+
+class Singleton(metaclass=SingletonMeta):
+    pass
+
+def benchmark_singleton(threads=32, calls=100_000):
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    class Contended(metaclass=SingletonMeta):
+        def __init__(self):
+            time.sleep(0.01)  # widen the first-access race window
+
+    barrier = threading.Barrier(threads)
 
-    def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    def worker():
+        barrier.wait()
+        seen = {id(Contended()) for _ in range(calls)}
+        return seen
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        ids = set().union(*pool.map(lambda _: worker(), range(threads)))
+    elapsed = time.perf_counter() - start
+    total = threads * calls
+    print(f"{threads} threads, {total} calls: {elapsed:.3f}s "
+          f"({total / elapsed:,.0f} calls/s), {len(ids)} distinct instance(s)")
+    return elapsed, len(ids)
 
 #=================
 #=================
@@ -110,15 +207,184 @@ class CarBuilder:
 
 import copy
 
+_IMMUTABLE_TYPES = frozenset([int, float, complex, bool, str, bytes,
+                              type(None), frozenset, range])
+
+def _is_immutable(value):
+    kind = type(value)
+    if kind in _IMMUTABLE_TYPES:
+        return True
+    if kind is tuple:
+        return all(_is_immutable(item) for item in value)
+    return False
+
+_SHARE, _FLAT_LIST, _FLAT_DICT, _LIST, _DICT, _OBJECT, _DEEP = range(7)
+
+def _overrides(cls, name):
+    method = getattr(cls, name, None)
+    return method is not None and method is not getattr(object, name, None)
+
+class CloneEngine:
+    # Deep copies with the same result as copy.deepcopy, but with fast
+    # paths: immutable values are shared, lists and dicts are copied
+    # directly, and plain objects are rebuilt from their __dict__. Whether a
+    # class can take the fast path is decided once per class and cached;
+    # everything else goes through deepcopy with the same id()-keyed memo,
+    # so shared references and cycles are preserved throughout.
+    #
+    # clone() copies the registered object as it is at call time.
+    # clone_many() reads it once into a plan of the object graph and
+    # replays that plan n times.
+    def __init__(self):
+        self._templates = {}
+        self._copyable = {}
+
+    def register(self, name, obj):
+        self._templates[name] = obj
+
+    def _is_copyable(self, cls):
+        # Classes that customise copying or pickling, keep state outside
+        # __dict__ or extend a builtin type stay on the deepcopy path.
+        copyable = self._copyable.get(cls)
+        if copyable is None:
+            copyable = self._copyable[cls] = not (
+                hasattr(cls, "__deepcopy__") or hasattr(cls, "__setstate__")
+                or hasattr(cls, "__getnewargs__") or hasattr(cls, "__getnewargs_ex__")
+                or _overrides(cls, "__reduce_ex__") or _overrides(cls, "__reduce__")
+                or _overrides(cls, "__getstate__")
+                or getattr(cls, "__slots__", None)
+                or any(base.__module__ == "builtins" for base in cls.__mro__[:-1]))
+        return copyable
+
+    def _copy(self, value, memo):
+        if _is_immutable(value):
+            return value
+        obj = memo.get(id(value))
+        if obj is not None:
+            return obj
+        kind = type(value)
+        copy_ = self._copy
+        if kind is list:
+            obj = memo[id(value)] = []
+            obj.extend([item if _is_immutable(item) else copy_(item, memo) for item in value])
+        elif kind is dict and all(_is_immutable(key) for key in value):
+            obj = memo[id(value)] = {}
+            for key, item in value.items():
+                obj[key] = item if _is_immutable(item) else copy_(item, memo)
+        elif hasattr(value, "__dict__") and self._is_copyable(kind):
+            obj = memo[id(value)] = kind.__new__(kind)
+            obj.__dict__.update([(name, item if _is_immutable(item) else copy_(item, memo))
+                                 for name, item in vars(value).items()])
+        else:
+            obj = copy.deepcopy(value, memo)
+        return obj
+
+    def _snapshot(self, value, memo):
+        if _is_immutable(value):
+            return (_SHARE, value)
+        node = memo.get(id(value))
+        if node is not None:
+            return node
+        kind = type(value)
+        if kind is list:
+            if all(_is_immutable(item) for item in value):
+                node = memo[id(value)] = [_FLAT_LIST, tuple(value)]
+            else:
+                node = memo[id(value)] = [_LIST, None]
+                node[1] = [self._snapshot(item, memo) for item in value]
+        elif kind is dict and all(_is_immutable(key) for key in value):
+            if all(_is_immutable(item) for item in value.values()):
+                node = memo[id(value)] = [_FLAT_DICT, dict(value)]
+            else:
+                node = memo[id(value)] = [_DICT, None]
+                node[1] = [(key, self._snapshot(item, memo)) for key, item in value.items()]
+        elif hasattr(value, "__dict__") and self._is_copyable(kind):
+            node = memo[id(value)] = [_OBJECT, kind, None]
+            node[2] = [(name, self._snapshot(item, memo)) for name, item in vars(value).items()]
+        else:
+            node = memo[id(value)] = [_DEEP, copy.deepcopy(value)]
+        return node
+
+    def _build(self, node, memo):
+        kind = node[0]
+        if kind is _SHARE:
+            return node[1]
+        obj = memo.get(id(node))
+        if obj is not None:
+            return obj
+        build = self._build
+        if kind is _FLAT_LIST:
+            obj = memo[id(node)] = list(node[1])
+        elif kind is _FLAT_DICT:
+            obj = memo[id(node)] = dict(node[1])
+        elif kind is _LIST:
+            obj = memo[id(node)] = []
+            obj.extend([build(item, memo) for item in node[1]])
+        elif kind is _DICT:
+            obj = memo[id(node)] = {}
+            for key, item in node[1]:
+                obj[key] = build(item, memo)
+        elif kind is _OBJECT:
+            cls = node[1]
+            obj = memo[id(node)] = cls.__new__(cls)
+            obj.__dict__.update([(name, build(item, memo)) for name, item in node[2]])
+        else:
+            obj = memo[id(node)] = copy.deepcopy(node[1])
+        return obj
+
+    def clone(self, name):
+        obj = self._templates.get(name)
+        return None if obj is None else self._copy(obj, {})
+
+    def clone_many(self, name, n):
+        obj = self._templates.get(name)
+        if obj is None:
+            return [None] * n
+        snapshot = self._snapshot(obj, {})
+        build = self._build
+        return [build(snapshot, {}) for _ in range(n)]
+
+    def copy(self, obj):
+        return self._copy(obj, {})
+
 class Prototype:
     def __init__(self):
         self._objects = {}
+        self._engine = CloneEngine()
 
     def register_object(self, name, obj):
         self._objects[name] = obj
+        self._engine.register(name, obj)
 
     def clone(self, name):
-        return copy.deepcopy(self._objects.get(name))
+        return self._engine.clone(name)
+
+    def clone_many(self, name, n):
+        return self._engine.clone_many(name, n)
+
+def benchmark_clone(n=10_000):
+    import timeit
+
+    class Template:
+        def __init__(self, depth):
+            self.name = "template"
+            self.size = (10, 20)
+            self.tags = ["a", "b", "c"] * 10
+            self.meta = {f"k{i}": i for i in range(20)}
+            self.child = Template(depth - 1) if depth else None
+
+    results = {}
+    for label, depth in (("shallow", 0), ("deep", 8)):
+        prototype = Prototype()
+        template = Template(depth)
+        prototype.register_object("t", template)
+        results[label] = {
+            "deepcopy": timeit.timeit(lambda: [copy.deepcopy(template) for _ in range(n)], number=1),
+            "clone_many": timeit.timeit(lambda: prototype.clone_many("t", n), number=1),
+        }
+        for engine, seconds in results[label].items():
+            print(f"{label:>8} {engine:>10}: {seconds:.3f}s for {n} clones")
+    return results
 
 #=================
 #=================
@@ -172,25 +438,178 @@ class Circle:
 #=================
 #=================
 
+ENTER, LEAVE = "enter", "leave"
+
+def walk(root, descend=None):
+    # Explicit-stack depth-first walk yielding (ENTER, node) / (LEAVE, node)
+    # events, so arbitrarily deep trees never touch the recursion limit.
+    # descend(node) may return False to treat a node as a leaf.
+    yield ENTER, root
+    stack = [iter(getattr(root, "children", ()))]
+    nodes = [root]
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            yield LEAVE, nodes.pop()
+            continue
+        yield ENTER, child
+        if descend is None or descend(child):
+            stack.append(iter(getattr(child, "children", ())))
+            nodes.append(child)
+        else:
+            yield LEAVE, child
+
+def traverse(root, order="pre", descend=None):
+    if order not in ("pre", "post"):
+        raise ValueError("order must be 'pre' or 'post'")
+    wanted = ENTER if order == "pre" else LEAVE
+    for event, node in walk(root, descend):
+        if event is wanted:
+            yield node
+
+def aggregate_postorder(root, combine, descend=None):
+    # combine(node, child_values) -> value, children before parents.
+    values = []
+    for event, node in walk(root, descend):
+        if event is ENTER:
+            values.append([])
+        else:
+            value = combine(node, values.pop())
+            if not values:
+                return value
+            values[-1].append(value)
+
+def aggregate_preorder(root, combine, initial=None, descend=None):
+    # Yields (node, value) where value = combine(node, parent_value),
+    # parents before children.
+    values = [initial]
+    for event, node in walk(root, descend):
+        if event is ENTER:
+            value = combine(node, values[-1])
+            values.append(value)
+            yield node, value
+        else:
+            values.pop()
+
+class Rope:
+    # Deferred concatenation of str and Rope parts. Nesting ropes costs
+    # nothing per level; str() joins everything once, without recursion.
+    __slots__ = ("parts", "length")
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.length = sum(len(part) for part in parts)
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        out, stack = [], [iter(self.parts)]
+        while stack:
+            for part in stack[-1]:
+                if isinstance(part, Rope):
+                    stack.append(iter(part.parts))
+                    break
+                out.append(part)
+            else:
+                stack.pop()
+        return "".join(out)
+
 class Component(ABC):
+    _parents = ()
+
     @abstractmethod
     def operation(self):
         pass
 
+    def changed(self):
+        # Dirty every cached ancestor. A composite that is already dirty
+        # had its own ancestors dirtied at the same time, so stop there.
+        stack = list(self._parents)
+        while stack:
+            node = stack.pop()
+            if node._cache is not None:
+                node._cache = None
+                stack.extend(node._parents)
+
 class Leaf(Component):
     def operation(self):
         return "Leaf"
 
 class Composite(Component):
+    # Subtrees rendering to more than cache_limit characters are not
+    # cached: caching every level of a deep tree stores O(depth ** 2)
+    # characters. They are assembled as Ropes and joined once at the top.
+    cache_hits = 0
+    cache_misses = 0
+    cache_limit = 1 << 12
+
     def __init__(self):
         self.children = []
+        self._cache = None
 
     def add(self, component):
         self.children.append(component)
+        if "_parents" not in component.__dict__:
+            component._parents = []
+        component._parents.append(self)
+        self._cache = None
+        self.changed()
+
+    @staticmethod
+    def _is_dirty(node):
+        return isinstance(node, Composite) and node._cache is None
 
     def operation(self):
-        results = [child.operation() for child in self.children]
-        return f"Composite({'+'.join(results)})"
+        if self._cache is not None:
+            Composite.cache_hits += 1
+            return self._cache
+
+        def combine(node, results):
+            if not Composite._is_dirty(node):
+                return node.operation()
+            Composite.cache_misses += 1
+            parts = ["Composite("]
+            for i, result in enumerate(results):
+                if i:
+                    parts.append("+")
+                parts.append(result)
+            parts.append(")")
+            text = Rope(parts)
+            if len(text) > Composite.cache_limit:
+                return text
+            node._cache = str(text)
+            return node._cache
+        return str(aggregate_postorder(self, combine, Composite._is_dirty))
+
+    def iter_operation(self):
+        # Streams the same text as operation() piece by piece, without
+        # building (or caching) the joined string of every subtree.
+        if self._cache is not None:
+            Composite.cache_hits += 1
+            yield self._cache
+            return
+        first = []
+        for event, node in walk(self, Composite._is_dirty):
+            dirty = Composite._is_dirty(node)
+            if event is ENTER:
+                if first:
+                    if not first[-1]:
+                        yield "+"
+                    first[-1] = False
+                if dirty:
+                    first.append(True)
+                    yield "Composite("
+            elif dirty:
+                first.pop()
+                yield ")"
+            else:
+                yield node.operation()
+
+    @classmethod
+    def reset_cache_stats(cls):
+        Composite.cache_hits = Composite.cache_misses = 0
 
 #=================
 #=================
@@ -203,11 +622,43 @@ class Coffee:
         return 5
 
 class MilkDecorator:
+    extra = 2
+
     def __init__(self, coffee):
         self._coffee = coffee
 
     def cost(self):
-        return self._coffee.cost() + 2
+        return self._coffee.cost() + self.extra
+
+def compile_cost(coffee):
+    # Fuse a stack of additive decorators into one call: the extras are
+    # summed once here instead of on every cost() through every layer.
+    # The first layer that is not a plain additive decorator is kept as is.
+    extra = 0
+    while isinstance(coffee, MilkDecorator) and type(coffee).cost is MilkDecorator.cost:
+        extra += coffee.extra
+        coffee = coffee._coffee
+    base_cost = coffee.cost
+    if type(coffee) is Coffee:
+        total = base_cost() + extra
+        return lambda: total
+    return lambda: base_cost() + extra
+
+def benchmark_decorators(layers=(1, 10, 100), calls=100_000):
+    import timeit
+
+    results = {}
+    for depth in layers:
+        coffee = Coffee()
+        for _ in range(depth):
+            coffee = MilkDecorator(coffee)
+        fused = compile_cost(coffee)
+        assert fused() == coffee.cost()
+        results[depth] = (timeit.timeit(coffee.cost, number=calls),
+                          timeit.timeit(fused, number=calls))
+        print(f"{depth:>4} layers: layered {results[depth][0]:.3f}s, "
+              f"compiled {results[depth][1]:.3f}s for {calls} calls")
+    return results
 
 #=================
 #=================
@@ -245,14 +696,99 @@ class TreeType:
         self.name = name
         self.color = color
 
+import sys
+import weakref
+from collections import OrderedDict
+
+class InterningStore:
+    # Flyweight table split into lock stripes, so concurrent lookups of
+    # different keys rarely contend. weak=True lets unused flyweights be
+    # collected; max_size bounds each stripe (max_size / stripes entries)
+    # with LRU eviction, which makes the bound approximate across stripes.
+    # Small caps use fewer stripes so that uneven hashing does not evict
+    # entries long before the store is actually full.
+    def __init__(self, weak=False, max_size=None, stripes=16):
+        self.weak = weak
+        self.max_size = max_size
+        if max_size is not None:
+            stripes = max(1, min(stripes, max_size // 64))
+        self._stripe_cap = None if max_size is None else max(1, -(-max_size // stripes))
+        self._stripes = [_Stripe(weak, max_size is not None) for _ in range(stripes)]
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get_or_create(self, key, create):
+        stripe = self._stripe(key)
+        with stripe.lock:
+            value = stripe.entries.get(key)
+            if value is not None:
+                stripe.hits += 1
+                if stripe.order is not None:
+                    stripe.order.move_to_end(key)
+                return value
+            stripe.misses += 1
+            value = create()
+            stripe.entries[key] = value
+            stripe.bytes += sys.getsizeof(value) + sys.getsizeof(getattr(value, "__dict__", None))
+            if stripe.order is not None:
+                stripe.order[key] = None
+                self._evict(stripe)
+            return value
+
+    def _evict(self, stripe):
+        cap = self._stripe_cap
+        while cap is not None and len(stripe.order) > cap:
+            key, _ = stripe.order.popitem(last=False)
+            if stripe.entries.pop(key, None) is not None:
+                stripe.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._stripe(key).entries
+
+    def __len__(self):
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                if stripe.order is not None:
+                    stripe.order.clear()
+
+    def stats(self):
+        hits = sum(stripe.hits for stripe in self._stripes)
+        misses = sum(stripe.misses for stripe in self._stripes)
+        created_bytes = sum(stripe.bytes for stripe in self._stripes)
+        # Every hit is an object that did not have to be allocated.
+        avg_bytes = created_bytes / misses if misses else 0
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "evictions": sum(stripe.evictions for stripe in self._stripes),
+            "live_entries": len(self),
+            "bytes_saved": int(hits * avg_bytes),
+        }
+
+class _Stripe:
+    def __init__(self, weak, bounded):
+        self.lock = threading.Lock()
+        self.entries = weakref.WeakValueDictionary() if weak else {}
+        # Recency order is only kept when there is a cap to enforce.
+        self.order = OrderedDict() if bounded else None
+        self.hits = self.misses = self.evictions = self.bytes = 0
+
 class TreeFactory:
-    _tree_types = {}
+    _tree_types = InterningStore()
+
+    @classmethod
+    def configure(cls, weak=False, max_size=None, stripes=16):
+        cls._tree_types = InterningStore(weak, max_size, stripes)
 
     def get_tree_type(self, name, color):
         key = (name, color)
-        if key not in self._tree_types:
-            self._tree_types[key] = TreeType(name, color)
-        return self._tree_types[key]
+        return self._tree_types.get_or_create(key, lambda: TreeType(name, color))
 
 #=================
 #=================
@@ -260,13 +796,49 @@ class TreeFactory:
 #=================
 #=================
 
+import mmap
+
+class FileMapping:
+    # One read-only mapping per file, shared by every image of that file
+    # and closed by the GC once the last of them lets go. Pages are only
+    # read from disk when a slice of the view is actually touched.
+    _open = weakref.WeakValueDictionary()
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            # mmap refuses empty files; an empty view behaves the same.
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self._mmap) if size else memoryview(b"")
+
+    @classmethod
+    def open(cls, path):
+        key = os.path.realpath(path)
+        with cls._lock:
+            mapping = cls._open.get(key)
+            if mapping is None:
+                mapping = cls._open[key] = cls(key)
+            return mapping
+
+    def __len__(self):
+        return len(self.view)
+
 class RealImage:
     def __init__(self, filename):
         self.filename = filename
+        self.data = memoryview(b"")
         self.load()
 
     def load(self):
         print(f"Loading {self.filename}")
+        if os.path.isfile(self.filename):
+            self._mapping = FileMapping.open(self.filename)
+            self.data = self._mapping.view
+
+    def slice(self, start, stop):
+        return self.data[start:stop]
 
     def display(self):
         print(f"Displaying {self.filename}")
@@ -287,6 +859,23 @@ class ProxyImage:
 #=================
 #=================
 
+class _Pass:
+    # Pickles by name so PASS keeps its identity across process pools.
+    def __reduce__(self):
+        return "PASS"
+
+    def __repr__(self):
+        return "PASS"
+
+# Returned by process() when a handler passes the request along.
+PASS = _Pass()
+
+def compilable(handle):
+    # Marks a handle() that only forwards what process() passes, so
+    # compile_chain can replace the whole chain with a flat loop.
+    handle.compilable = True
+    return handle
+
 class Handler(ABC):
     def __init__(self):
         self._next_handler = None
@@ -295,17 +884,210 @@ class Handler(ABC):
         self._next_handler = handler
         return handler
 
-    @abstractmethod
-    def handle(self, request):
-        pass
+    def successor(self):
+        return self._next_handler
 
-class ConcreteHandlerA(Handler):
+    def process(self, request):
+        return PASS
+
+    def process_many(self, requests):
+        return [self.process(request) for request in requests]
+
+    def end_of_chain(self, request):
+        return None
+
+    @compilable
     def handle(self, request):
-        if request == "A":
-            return "Handled by A"
-        elif self._next_handler:
+        result = self.process(request)
+        if result is not PASS:
+            return result
+        if self._next_handler:
             return self._next_handler.handle(request)
-        return None
+        return self.end_of_chain(request)
+
+    def handle_many(self, requests, **options):
+        return handle_many(self, requests, **options)
+
+class KeyHandler(Handler):
+    # Handles exactly the requests equal to `key`; chains of these compile
+    # to a single dict lookup.
+    key = None
+    result = None
+
+    def process(self, request):
+        return self.result if request == self.key else PASS
+
+class ConcreteHandlerA(KeyHandler):
+    key = "A"
+    result = "Handled by A"
+
+def compile_chain(head):
+    # Flatten the chain into one non-recursive callable with the same
+    # results. Runs of plain KeyHandlers become one dict lookup, other
+    # handlers are called through process() in a loop, and a handler
+    # with its own handle() ends the chain and is called as is.
+    steps = []
+    table = None
+    handler = last = head
+    while handler is not None:
+        last = handler
+        if not getattr(type(handler).handle, "compilable", False):
+            steps.append(handler.handle)
+            break
+        if isinstance(handler, KeyHandler) and type(handler).process is KeyHandler.process:
+            if table is None:
+                table = {}
+                steps.append(_lookup_step(table))
+            table.setdefault(handler.key, handler.result)
+        else:
+            table = None
+            steps.append(handler.process)
+        handler = handler.successor()
+    end_of_chain = getattr(last, "end_of_chain", lambda request: None)
+
+    def compiled(request):
+        for step in steps:
+            result = step(request)
+            if result is not PASS:
+                return result
+        return end_of_chain(request)
+    return compiled
+
+def _lookup_step(table):
+    def lookup(request):
+        try:
+            return table.get(request, PASS)
+        except TypeError:  # unhashable requests never equal a key
+            return PASS
+    return lookup
+
+import functools
+import queue
+
+_DONE = object()
+
+def _handle_each(handler, requests):
+    return [handler.handle(request) for request in requests]
+
+def _chain_stages(head):
+    stages = []
+    handler = last = head
+    while handler is not None:
+        last = handler
+        if not getattr(type(handler).handle, "compilable", False):
+            stages.append(functools.partial(_handle_each, handler))
+            break
+        stages.append(handler.process_many)
+        handler = handler.successor()
+    return stages, last
+
+def _chunks(requests, size):
+    chunk = []
+    for request in requests:
+        chunk.append(request)
+        if len(chunk) == size:
+            yield [chunk, [PASS] * size, list(range(size))]
+            chunk = []
+    if chunk:
+        yield [chunk, [PASS] * len(chunk), list(range(len(chunk)))]
+
+def _apply(stage, chunk, executor):
+    # Runs one stage over the requests of a chunk still marked PASS.
+    requests, results, pending = chunk
+    if not pending:
+        return chunk
+    batch = [requests[i] for i in pending]
+    outputs = stage(batch) if executor is None else executor.submit(stage, batch).result()
+    still_pending = []
+    for i, output in zip(pending, outputs):
+        if output is PASS:
+            still_pending.append(i)
+        else:
+            results[i] = output
+    chunk[2] = still_pending
+    return chunk
+
+def _finish(chunk, last):
+    requests, results, pending = chunk
+    end_of_chain = getattr(last, "end_of_chain", lambda request: None)
+    for i in pending:
+        results[i] = end_of_chain(requests[i])
+    return results
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def handle_many(head, requests, chunk_size=1024, executor=None, max_pending=4):
+    # Streams results for `requests` in order, running each handler over
+    # whole chunks via process_many(). With an executor (thread or
+    # process pool) every stage gets its own feeder thread and submits
+    # its chunks to the pool; stages are linked by queues holding at most
+    # max_pending chunks, so a slow stage holds back the ones before it.
+    stages, last = _chain_stages(head)
+    chunks = _chunks(requests, chunk_size)
+    if executor is None:
+        for chunk in chunks:
+            for stage in stages:
+                _apply(stage, chunk, None)
+            yield from _finish(chunk, last)
+        return
+
+    stop = threading.Event()
+    queues = [queue.Queue(max_pending) for _ in range(len(stages) + 1)]
+
+    def feed():
+        try:
+            for chunk in chunks:
+                if not _put(queues[0], chunk, stop):
+                    return
+        except BaseException as exc:
+            _put(queues[0], exc, stop)
+            return
+        _put(queues[0], _DONE, stop)
+
+    def run(stage, inbox, outbox):
+        while not stop.is_set():
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is not _DONE and not isinstance(item, BaseException):
+                try:
+                    item = _apply(stage, item, executor)
+                except BaseException as exc:
+                    item = exc
+            if not _put(outbox, item, stop) or item is _DONE or isinstance(item, BaseException):
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=run, args=(stage, queues[i], queues[i + 1]), daemon=True)
+                for i, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from _finish(item, last)
+    finally:
+        stop.set()
+
+def verify_chain(head, requests, compiled=None):
+    compiled = compiled or compile_chain(head)
+    for request in requests:
+        expected, actual = head.handle(request), compiled(request)
+        if expected != actual:
+            raise AssertionError(f"compiled chain returned {actual!r} for {request!r}, expected {expected!r}")
+    return compiled
 
 #=================
 #=================
@@ -343,6 +1125,11 @@ class Expression(ABC):
     def interpret(self, context):
         pass
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 class TerminalExpression(Expression):
     def __init__(self, data):
         self.data = data
@@ -350,6 +1137,20 @@ class TerminalExpression(Expression):
     def interpret(self, context):
         return self.data in context
 
+    def interpret_batch(self, contexts):
+        # contexts is either a 1-D array of strings (substring membership,
+        # as `in` on a str) or a 2-D array with one row of items per
+        # context, checked in one vectorized pass. Anything else is
+        # checked row by row.
+        if np is None:
+            raise ImportError("interpret_batch requires numpy")
+        contexts = np.asarray(contexts)
+        if contexts.ndim == 1 and contexts.dtype.kind in "US":
+            return np.char.find(contexts, self.data) >= 0
+        if contexts.ndim == 2 and contexts.dtype.kind != "O":
+            return np.isin(contexts, [self.data]).any(axis=1)
+        return np.fromiter((self.data in context for context in contexts), dtype=bool, count=len(contexts))
+
 #=================
 #=================
 # Iterator Pattern
@@ -357,8 +1158,8 @@ class TerminalExpression(Expression):
 #=================
 
 class NameRepository:
-    def __init__(self):
-        self.names = ["John", "Jane", "Doe"]
+    def __init__(self, names=None):
+        self.names = ["John", "Jane", "Doe"] if names is None else names
 
     def __iter__(self):
         return iter(self.names)
@@ -369,9 +1170,143 @@ class NameRepository:
 #=================
 #=================
 
+import asyncio
+import time
+
+class Subscription:
+    # A subscriber's bounded inbox. policy decides what happens when it is
+    # full: "drop_newest" discards the incoming message, "drop_oldest"
+    # discards the oldest queued one, "block" makes publishers wait.
+    def __init__(self, bus, subscriber, topics, maxsize, policy):
+        if policy not in ("drop_newest", "drop_oldest", "block"):
+            raise ValueError(f"Unknown overflow policy {policy!r}")
+        self.bus = bus
+        self.subscriber = subscriber
+        self.topics = set(topics)
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def offer(self, item):
+        # Non-blocking delivery; returns False if a message was lost, either
+        # the incoming one or, under drop_oldest, the one it evicted. The
+        # evicted message was already counted as delivered, so the new one
+        # takes its place rather than adding to the count.
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.policy == "drop_oldest":
+            self.queue.get_nowait()
+            self.queue.put_nowait(item)
+        self.dropped += 1
+        return False
+
+    async def get(self):
+        sent_at, topic, message = await self.queue.get()
+        self.bus._record_latency(time.perf_counter() - sent_at)
+        return topic, message
+
+    def get_nowait(self):
+        sent_at, topic, message = self.queue.get_nowait()
+        self.bus._record_latency(time.perf_counter() - sent_at)
+        return topic, message
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+class MessageBus:
+    # Topic-indexed pub/sub: a publish only touches the subscriptions of
+    # its topic, never the full subscriber list.
+    def __init__(self):
+        self._topics = {}
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._latency_total = 0.0
+        self._latency_count = 0
+        self._latency_max = 0.0
+        self._started = time.perf_counter()
+
+    def subscribe(self, subscriber, topics, maxsize=1024, policy="drop_oldest"):
+        subscription = Subscription(self, subscriber, topics, maxsize, policy)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, {})[id(subscription)] = subscription
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.pop(id(subscription), None)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def subscribers(self, topic):
+        return list(self._topics.get(topic, {}).values())
+
+    def publish_nowait(self, topic, message):
+        # Never waits: "block" subscribers are treated as drop_newest here.
+        return self._fan_out(topic, [message])
+
+    async def publish(self, topic, message):
+        return await self.publish_batch(topic, [message])
+
+    async def publish_batch(self, topic, messages):
+        # One subscriber lookup per batch; only "block" subscribers that are
+        # full make the publisher wait.
+        waiting = []
+        delivered = self._fan_out(topic, messages, waiting)
+        for subscription, item in waiting:
+            await subscription.queue.put(item)
+            delivered += 1
+        self.delivered += len(waiting)
+        return delivered
+
+    def _fan_out(self, topic, messages, waiting=None):
+        subscriptions = list(self._topics.get(topic, {}).values())
+        sent_at = time.perf_counter()
+        delivered = 0
+        for message in messages:
+            item = (sent_at, topic, message)
+            for subscription in subscriptions:
+                if waiting is not None and subscription.policy == "block" and subscription.queue.full():
+                    waiting.append((subscription, item))
+                elif subscription.offer(item):
+                    delivered += 1
+                else:
+                    self.dropped += 1
+        self.published += len(messages)
+        self.delivered += delivered
+        return delivered
+
+    def _record_latency(self, seconds):
+        self._latency_total += seconds
+        self._latency_count += 1
+        self._latency_max = max(self._latency_max, seconds)
+
+    def metrics(self):
+        elapsed = time.perf_counter() - self._started
+        count = self._latency_count
+        return {
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "throughput": self.delivered / elapsed if elapsed else 0.0,
+            "latency_avg": self._latency_total / count if count else 0.0,
+            "latency_max": self._latency_max,
+        }
+
 class ChatRoom:
+    def __init__(self, name="lobby", bus=None):
+        self.name = name
+        self.bus = bus
+
     def show_message(self, user, message):
         print(f"[{user}] {message}")
+        if self.bus is not None:
+            self.bus.publish_nowait(f"room:{self.name}", f"[{user}] {message}")
 
 class User:
     def __init__(self, name, chatroom):
@@ -394,19 +1329,206 @@ class Memento:
     def get_state(self):
         return self._state
 
+import bisect
+import pickle
+import zlib
+
+_KEYFRAME, _TEXT_DELTA, _DICT_DELTA = range(3)
+
+def _common_length(old, new, limit, from_end):
+    # Bisect on slice equality so the comparisons run at C speed.
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if from_end:
+            same = old[len(old) - mid:len(old) - lo] == new[len(new) - mid:len(new) - lo]
+        else:
+            same = old[lo:mid] == new[lo:mid]
+        if same:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _text_delta(old, new):
+    # (prefix length, suffix length, replacement) for str/bytes/tuple edits.
+    limit = min(len(old), len(new))
+    prefix = _common_length(old, new, limit, False)
+    suffix = _common_length(old, new, limit - prefix, True)
+    return prefix, suffix, new[prefix:len(new) - suffix]
+
+def _apply_text_delta(old, delta):
+    prefix, suffix, middle = delta
+    return old[:prefix] + middle + old[len(old) - suffix:]
+
+def _dict_delta(old, new):
+    changed = {key: value for key, value in new.items() if key not in old or old[key] is not value and old[key] != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+def _apply_dict_delta(old, delta):
+    changed, removed = delta
+    state = dict(old)
+    for key in removed:
+        del state[key]
+    state.update(changed)
+    return state
+
+class HistoryStore:
+    # Bounded history of states. Most entries are deltas against the state
+    # before them, with a full keyframe every keyframe_interval entries, so
+    # get(i) is a bisect over keyframe positions plus at most that many
+    # delta applications. Entries more than compress_after steps old are
+    # pickled and zlib-compressed. str/bytes/tuple and dict states are
+    # delta-encoded; any other state is always stored as a keyframe.
+    def __init__(self, capacity=None, keyframe_interval=32, compress_after=None):
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.compress_after = compress_after
+        self._entries = {}
+        self._keyframes = []
+        self._first = 0
+        self._next = 0
+        self._last = None
+
+    def __len__(self):
+        return self._next - self._first
+
+    def _delta(self, state):
+        last = self._last
+        since_keyframe = self._next - self._keyframes[-1] if self._keyframes else None
+        if since_keyframe is None or since_keyframe >= self.keyframe_interval or type(state) is not type(last):
+            return None
+        if isinstance(state, (str, bytes, tuple)):
+            delta = _text_delta(last, state)
+            return (_TEXT_DELTA, delta) if len(delta[2]) * 2 < len(state) else None
+        if isinstance(state, dict):
+            delta = _dict_delta(last, state)
+            return (_DICT_DELTA, delta) if len(delta[0]) + len(delta[1]) < len(state) else None
+        return None
+
+    def append(self, state, wrap=None):
+        if isinstance(state, dict):
+            state = dict(state)  # later in-place edits must not reach history
+        delta = self._delta(state)
+        seq = self._next
+        if delta is None:
+            self._entries[seq] = [_KEYFRAME, state, False, wrap]
+            self._keyframes.append(seq)
+        else:
+            self._entries[seq] = [delta[0], delta[1], False, wrap]
+        self._last = state
+        self._next += 1
+        if self.compress_after is not None:
+            self._compress(seq - self.compress_after)
+        if self.capacity is not None:
+            while len(self) > self.capacity:
+                self._drop_oldest()
+
+    def _compress(self, seq):
+        entry = self._entries.get(seq)
+        if entry is not None and not entry[2]:
+            entry[1] = zlib.compress(pickle.dumps(entry[1], pickle.HIGHEST_PROTOCOL))
+            entry[2] = True
+
+    def _payload(self, entry):
+        return pickle.loads(zlib.decompress(entry[1])) if entry[2] else entry[1]
+
+    def _state(self, seq):
+        index = bisect.bisect_right(self._keyframes, seq) - 1
+        keyframe = self._keyframes[index]
+        state = self._payload(self._entries[keyframe])
+        for step in range(keyframe + 1, seq + 1):
+            entry = self._entries[step]
+            if entry[0] == _TEXT_DELTA:
+                state = _apply_text_delta(state, self._payload(entry))
+            else:
+                state = _apply_dict_delta(state, self._payload(entry))
+        return state
+
+    def _drop_oldest(self):
+        first = self._first
+        successor = self._entries.get(first + 1)
+        if successor is not None and successor[0] != _KEYFRAME:
+            # The next entry becomes the oldest, so it must stand alone.
+            successor[:3] = [_KEYFRAME, self._state(first + 1), False]
+            self._keyframes.insert(1, first + 1)
+        del self._entries[first]
+        del self._keyframes[0]
+        self._first += 1
+
+    def get(self, index):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("history index out of range")
+        seq = self._first + index
+        state = self._state(seq)
+        if isinstance(state, dict) and self._entries[seq][0] == _KEYFRAME:
+            state = dict(state)
+        wrap = self._entries[seq][3]
+        return wrap(state) if wrap is not None else state
+
+    __getitem__ = get
+
 class Originator:
-    def __init__(self):
+    def __init__(self, history=None):
         self._state = None
+        self.history = history
 
     def set_state(self, state):
         self._state = state
 
     def save(self):
+        if self.history is not None:
+            self.history.append(self._state)
         return Memento(self._state)
 
     def restore(self, memento):
         self._state = memento.get_state()
 
+    def restore_saved(self, index):
+        if self.history is None:
+            raise ValueError("Originator has no history; pass one to __init__")
+        self._state = self.history.get(index)
+
+def benchmark_history(steps=1000):
+    import random
+    import tracemalloc
+
+    def edits(kind):
+        rng = random.Random(0)
+        if kind == "string":
+            state = "x" * 100_000
+        else:
+            state = {f"key{i}": i for i in range(10_000)}
+        for _ in range(steps):
+            if kind == "string":
+                i = rng.randrange(len(state))
+                state = state[:i] + "edit" + state[i + 4:]
+            else:
+                state = dict(state)
+                state[f"key{rng.randrange(10_000)}"] = rng.random()
+            yield state
+
+    results = {}
+    for kind in ("string", "dict"):
+        for store in ("list", "HistoryStore", "HistoryStore+zlib"):
+            tracemalloc.start()
+            if store == "list":
+                history = [Memento(state) for state in edits(kind)]
+            else:
+                history = HistoryStore(compress_after=8 if store.endswith("zlib") else None)
+                for state in edits(kind):
+                    history.append(state)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[kind, store] = current
+            print(f"{kind:>6} {store:>18}: {current / 1024 ** 2:8.2f} MiB for {steps} states")
+            del history
+    return results
+
 #=================
 #=================
 # Observer Pattern